@@ -1,19 +1,51 @@
+import asyncio
+import os
+import re
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import List, Optional, Literal
 
 from bson import ObjectId
-from fastapi import FastAPI, Depends, HTTPException, Query, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse
 
-from api.models import BookListResponse, ChangeListResponse, ChangeEntry
-from api.utils import rate_limiter, parse_price
-from db.db import DB, COLLECTION, CHANGELOG_COLLECTION
+from api.models import BookHistoryResponse, BookListResponse, ChangeListResponse, ChangeEntry
+from api.snapshot import API_SERVING_MODE, SUMMARY_FIELDS, SnapshotStore
+from api.utils import (
+    rate_limiter, build_list_pipeline, build_price_filter, build_projection, to_naive_utc,
+)
+from crawler.images import IMAGE_DIR
+from db.db import DB, COLLECTION, CHANGELOG_COLLECTION, HISTORY_COLLECTION
 from db.models import Book
+from utils.utils import downsample
+
+# In-memory catalog for /books when API_SERVING_MODE=snapshot
+catalog = SnapshotStore()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    if API_SERVING_MODE != "snapshot":
+        yield
+        return
+
+    await catalog.refresh(DB)
+    refresher = asyncio.create_task(catalog.run(DB))
+    yield
+    refresher.cancel()
+
 
 app = FastAPI(
     title="Book Crawler API",
     description="RESTful API over scraped books and change logs.",
     version="1.0.0",
+    lifespan=lifespan,
 )
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# '<sha256><ext>' as written by crawler.images
+IMAGE_FILE_PATTERN = re.compile(r"[0-9a-f]{64}(\.[a-z0-9]+)?")
 
 
 @app.get(
@@ -23,16 +55,37 @@ app = FastAPI(
     summary="List books with filters and pagination",
 )
 async def list_books(
-    category=Query(None, description="Filter by category"),
-    min_price=Query(None, ge=0, description="Minimum price (incl. tax)"),
-    max_price=Query(None, ge=0, description="Maximum price (incl. tax)"),
-    rating=Query(None, ge=0, le=5, description="Minimum rating"),
+    category: Optional[str]=Query(None, description="Filter by category"),
+    min_price: Optional[float]=Query(None, ge=0, description="Minimum price (incl. tax)"),
+    max_price: Optional[float]=Query(None, ge=0, description="Maximum price (incl. tax)"),
+    rating: Optional[int]=Query(None, ge=0, le=5, description="Minimum rating"),
     sort_by: Optional[Literal["rating", "price", "reviews"]]=Query(
         "rating", description="Sort by rating, price, or reviews"
     ),
-    page=Query(1, ge=1),
-    page_size=Query(20, ge=1, le=100),
+    page: int=Query(1, ge=1),
+    page_size: int=Query(20, ge=1, le=100),
+    fields: Optional[str]=Query(
+        None, description="Comma-separated Book fields to return. Default: summary view"
+    ),
 ):
+    # Only fetch the fields we return (skips raw_html, description, ...)
+    projection = build_projection(fields)
+    selected = [f for f in projection if f != "_id"]
+
+    # Snapshot mode: answered from memory when the snapshot has all requested fields
+    snapshot = catalog.current
+    if snapshot is not None and set(selected) <= set(SUMMARY_FIELDS):
+        total, items = snapshot.query(
+            category, min_price, max_price, rating, sort_by, page, page_size,
+            fields=selected if fields else None,
+        )
+        return ORJSONResponse({
+            "total": total,
+            "page": page,
+            "page_size": page_size,
+            "items": items,
+        })
+
     db = DB
     filters: dict = {}
 
@@ -40,45 +93,26 @@ async def list_books(
         filters["category"] = category
     if rating is not None:
         filters["rating"] = {"$gte": rating}
+    # Prices are stored as strings, so filter on their numeric value in Mongo
+    # (before counting and pagination, same as snapshot mode).
+    price_filter = build_price_filter(min_price, max_price)
+    if price_filter:
+        filters["$expr"] = price_filter
 
     # Count total before pagination
     total = await db[COLLECTION].count_documents(filters)
 
-    # Sorting
-    sort_field = {
-        "rating": "rating",
-        "price": "price_incl_tax",
-        "reviews": "number_of_reviews",
-    }.get(sort_by or "rating", "rating")
-
-    cursor = (
-        db[COLLECTION]
-        .find(filters)
-        .sort(sort_field, 1)
-        .skip((page - 1) * page_size)
-        .limit(page_size)
-    )
-    docs = await cursor.to_list(length=page_size)
+    pipeline = build_list_pipeline(filters, projection, sort_by, page, page_size)
+    items = await db[COLLECTION].aggregate(pipeline).to_list(length=page_size)
 
-    # Checks since prices are stored as strings
-    filtered_docs = []
-    for doc in docs:
-        price_val = parse_price(doc.get("price_incl_tax", "0"))
-        if min_price is not None and price_val < min_price:
-            continue
-        if max_price is not None and price_val > max_price:
-            continue
-        filtered_docs.append(doc)
-
-    # Map to Book model
-    books = [Book(**d) for d in filtered_docs]
-
-    return BookListResponse(
-        total=total,
-        page=page,
-        page_size=page_size,
-        items=books,
-    )
+    # Documents were validated by the crawler before being saved,
+    # so serialize them straight to JSON instead of rebuilding Book models.
+    return ORJSONResponse({
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "items": items,
+    })
 
 
 @app.get(
@@ -107,6 +141,98 @@ async def get_book(book_id: str):
     return Book(**doc)
 
 
+@app.get(
+    "/books/{book_id}/history",
+    response_model=BookHistoryResponse,
+    dependencies=[Depends(rate_limiter)],
+    summary="Price, stock and rating history for a book",
+)
+async def get_book_history(
+    book_id: str,
+    start: Optional[datetime] = Query(None, alias="from", description="Start time (UTC)"),
+    end: Optional[datetime] = Query(None, alias="to", description="End time (UTC)"),
+    resolution: Literal["day", "week", "month"] = Query(
+        "day", description="Group points per day, week or month"
+    ),
+):
+    db = DB
+    try:
+        oid = ObjectId(book_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid book_id",
+        )
+
+    doc = await db[COLLECTION].find_one({"_id": oid}, {"source_url": 1})
+    if not doc:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Book not found",
+        )
+
+    start, end = to_naive_utc(start), to_naive_utc(end)
+
+    # Monthly buckets overlapping [from, to]
+    filters: dict = {"book_url": doc["source_url"]}
+    if start or end:
+        filters["bucket_start"] = {}
+    if start:
+        filters["bucket_start"]["$gte"] = datetime(start.year, start.month, 1)
+    if end:
+        filters["bucket_start"]["$lte"] = end
+
+    cursor = db[HISTORY_COLLECTION].find(filters, {"points": 1})
+    buckets = await cursor.to_list(length=None)
+
+    points = [
+        p for bucket in buckets for p in bucket["points"]
+        if (not start or p["t"] >= start) and (not end or p["t"] <= end)
+    ]
+
+    return BookHistoryResponse(
+        book_url=doc["source_url"],
+        resolution=resolution,
+        items=downsample(points, resolution),
+    )
+
+
+@app.get(
+    "/images/{image_file}",
+    response_class=FileResponse,
+    summary="Serve a mirrored cover image",
+)
+async def get_image(image_file: str, if_none_match: Optional[str] = Header(None)):
+    # No API key here: browsers can't send headers from <img> tags.
+    # Files are content-addressed, so they never change and can be cached forever.
+    if not IMAGE_FILE_PATTERN.fullmatch(image_file):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image_file",
+        )
+
+    path = os.path.join(IMAGE_DIR, image_file)
+    if not os.path.exists(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found",
+        )
+
+    etag = f'"{image_file}"'
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": etag,
+    }
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in tags or "*" in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # Covers are already compressed; an explicit encoding keeps GZipMiddleware off them.
+    headers["Content-Encoding"] = "identity"
+    return FileResponse(path, headers=headers)
+
+
 @app.get(
     "/changes",
     response_model=ChangeListResponse,
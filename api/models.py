@@ -1,16 +1,33 @@
 from datetime import datetime
-from typing import List, Literal
+from typing import List, Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, HttpUrl
 
-from db.models import Book
+
+class BookSummary(BaseModel):
+    """Lightweight list view of a book. Leaves out raw_html and description."""
+    name: str
+    category: str
+    price_excl_tax: str
+    price_incl_tax: str
+    availability: str
+    rating: int
+    image_url: HttpUrl
+    image_file: Optional[str] = None
+    number_of_reviews: str
+    source_url: HttpUrl
+    crawl_timestamp: datetime | str
+    updated_at: Optional[datetime] = None
 
 
 class BookListResponse(BaseModel):
     total: int
     page: int
     page_size: int
-    items: List[Book]
+    # BookSummary by default, only the requested Book fields when `fields` is given
+    items: List[BookSummary | dict] = Field(
+        description="BookSummary items, or dicts with only the requested fields when `fields` is set"
+    )
 
 
 class ChangeEntry(BaseModel):
@@ -23,4 +40,31 @@ class ChangeEntry(BaseModel):
 
 class ChangeListResponse(BaseModel):
     total: int
-    items: List[ChangeEntry]
\ No newline at end of file
+    items: List[ChangeEntry]
+
+
+class SeriesStats(BaseModel):
+    min: float
+    max: float
+    last: float
+
+
+class CountSeriesStats(BaseModel):
+    min: int
+    max: int
+    last: int
+
+
+class HistoryPoint(BaseModel):
+    t: datetime  # Start of the day/week/month
+    count: int  # Observations in this period
+    price_incl_tax: SeriesStats
+    price_excl_tax: SeriesStats
+    stock: CountSeriesStats
+    rating: CountSeriesStats
+
+
+class BookHistoryResponse(BaseModel):
+    book_url: str
+    resolution: Literal["day", "week", "month"]
+    items: List[HistoryPoint]
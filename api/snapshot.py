@@ -0,0 +1,111 @@
+import asyncio
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+from api.models import BookSummary
+from db.db import COLLECTION, PROGRESS_COLLECTION, CATALOG_VERSION_ID
+from utils.utils import logger, parse_price, parse_stock
+
+load_dotenv()
+
+API_SERVING_MODE = os.getenv("API_SERVING_MODE")
+SNAPSHOT_REFRESH_SECONDS = float(os.getenv("SNAPSHOT_REFRESH_SECONDS"))
+
+SUMMARY_FIELDS = list(BookSummary.model_fields)
+
+
+def parse_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class CatalogSnapshot:
+    """
+    Columnar, read-only copy of the catalog's list view.
+    - NumPy columns for price, rating, reviews and stock
+    - Dictionary-encoded categories
+    - Prebuilt sort permutations, so a query is a mask + a slice
+    """
+
+    def __init__(self, docs, version=None):
+        self.version = version
+        self.rows = [{f: d[f] for f in SUMMARY_FIELDS if f in d} for d in docs]
+
+        self.categories = sorted({d.get("category", "") for d in docs})
+        self.category_index = {name: code for code, name in enumerate(self.categories)}
+
+        self.category = np.array([self.category_index[d.get("category", "")] for d in docs], dtype=np.int32)
+        self.price = np.array([parse_price(d.get("price_incl_tax")) for d in docs], dtype=np.float64)
+        self.rating = np.array([d.get("rating", 0) for d in docs], dtype=np.int8)
+        self.reviews = np.array([parse_int(d.get("number_of_reviews")) for d in docs], dtype=np.int32)
+        self.stock = np.array([parse_stock(d.get("availability")) for d in docs], dtype=np.int32)
+
+        self.sort_orders = {
+            "rating": np.argsort(self.rating, kind="stable"),
+            "price": np.argsort(self.price, kind="stable"),
+            "reviews": np.argsort(self.reviews, kind="stable"),
+        }
+
+    def __len__(self):
+        return len(self.rows)
+
+    def query(self, category=None, min_price=None, max_price=None, rating=None,
+              sort_by="rating", page=1, page_size=20, fields=None):
+        """Filter, sort and paginate. Returns (total, items)."""
+        mask = np.ones(len(self.rows), dtype=bool)
+        if category:
+            code = self.category_index.get(category)
+            if code is None:
+                return 0, []
+            mask &= self.category == code
+        if min_price is not None:
+            mask &= self.price >= min_price
+        if max_price is not None:
+            mask &= self.price <= max_price
+        if rating is not None:
+            mask &= self.rating >= rating
+
+        order = self.sort_orders.get(sort_by or "rating", self.sort_orders["rating"])
+        selected = order[mask[order]]
+        page_rows = selected[(page - 1) * page_size:page * page_size]
+
+        if fields is None:
+            items = [self.rows[i] for i in page_rows]
+        else:
+            items = [{f: self.rows[i][f] for f in fields if f in self.rows[i]} for i in page_rows]
+        return int(selected.size), items
+
+
+class SnapshotStore:
+    """Holds the current snapshot. Refreshes swap in a whole new one."""
+
+    def __init__(self):
+        self.current = None
+
+    async def refresh(self, db):
+        """Rebuild the snapshot if the crawler reported a new catalog version."""
+        progress = await db[PROGRESS_COLLECTION].find_one({"_id": CATALOG_VERSION_ID})
+        version = progress["version"] if progress else 0
+        if self.current is not None and self.current.version == version:
+            return False
+
+        projection = {f: 1 for f in SUMMARY_FIELDS}
+        projection["_id"] = 0
+        # _id order, so ties sort the same way as the Mongo path
+        docs = await db[COLLECTION].find({}, projection).sort("_id", 1).to_list(length=None)
+        self.current = CatalogSnapshot(docs, version)  # Single assignment, readers never see a partial snapshot
+        logger.info(f"Loaded catalog snapshot v{version} with {len(docs)} books.")
+        return True
+
+    async def run(self, db, interval=SNAPSHOT_REFRESH_SECONDS):
+        """Poll the catalog version until cancelled."""
+        while True:
+            try:
+                await self.refresh(db)
+            except Exception as e:
+                logger.error(f"Failed to refresh catalog snapshot: {e}")
+            await asyncio.sleep(interval)
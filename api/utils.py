@@ -1,11 +1,16 @@
 import os
 import time
 from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Optional
 
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import APIKeyHeader
 
+from api.models import BookSummary
+from db.models import Book
+
 
 load_dotenv()
 
@@ -53,13 +58,93 @@ async def rate_limiter(api_key=Depends(get_api_key)):
     timestamps.append(now)
 
 
-def parse_price(price_str: str) -> float:
-    """Convert '£10.00' -> 10.0. Fallback to 0.0 on any error."""
-    if not price_str:
-        return 0.0
-    # Remove currency symbol and commas
-    cleaned = price_str.replace("£", "").replace(",", "").strip()
-    try:
-        return float(cleaned)
-    except ValueError:
-        return 0.0
+def build_projection(fields: Optional[str]) -> dict:
+    """
+    Build the Mongo projection for the /books list view.
+    - No fields -> lightweight BookSummary fields
+    - "name,rating" -> only those Book fields
+    Unknown fields -> 400.
+    """
+    if not fields:
+        selected = list(BookSummary.model_fields)
+    else:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in Book.model_fields]
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(unknown)}",
+            )
+
+    projection = {f: 1 for f in selected}
+    projection["_id"] = 0
+    return projection
+
+
+# Numeric values of the string fields, computed in Mongo the same way as
+# parse_price() / snapshot.parse_int() (0 when the string doesn't parse).
+PRICE_VALUE = {
+    "$convert": {
+        "input": {
+            "$trim": {"input": {
+                "$replaceAll": {
+                    "input": {"$replaceAll": {"input": "$price_incl_tax", "find": "£", "replacement": ""}},
+                    "find": ",",
+                    "replacement": "",
+                }
+            }}
+        },
+        "to": "double",
+        "onError": 0.0,
+        "onNull": 0.0,
+    }
+}
+REVIEWS_VALUE = {
+    "$convert": {
+        "input": {"$trim": {"input": "$number_of_reviews"}},
+        "to": "int",
+        "onError": 0,
+        "onNull": 0,
+    }
+}
+SORT_VALUES = {
+    "rating": "$rating",
+    "price": PRICE_VALUE,
+    "reviews": REVIEWS_VALUE,
+}
+
+
+def build_price_filter(min_price: Optional[float], max_price: Optional[float]) -> Optional[dict]:
+    """Mongo $expr for a price_incl_tax range."""
+    if min_price is None and max_price is None:
+        return None
+
+    conditions = []
+    if min_price is not None:
+        conditions.append({"$gte": [PRICE_VALUE, min_price]})
+    if max_price is not None:
+        conditions.append({"$lte": [PRICE_VALUE, max_price]})
+    return {"$and": conditions}
+
+
+def build_list_pipeline(filters: dict, projection: dict, sort_by: str, page: int, page_size: int) -> list:
+    """
+    Aggregation for one /books page.
+    Sorts on the numeric value of price/reviews (not the stored strings), ties by _id,
+    so the order matches snapshot mode.
+    """
+    return [
+        {"$match": filters},
+        {"$addFields": {"_sort_value": SORT_VALUES.get(sort_by or "rating", "$rating")}},
+        {"$sort": {"_sort_value": 1, "_id": 1}},
+        {"$skip": (page - 1) * page_size},
+        {"$limit": page_size},
+        {"$project": projection},  # Inclusion projection, so _sort_value is dropped
+    ]
+
+
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Mongo returns naive UTC datetimes, so compare query times the same way."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
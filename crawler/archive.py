@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+import zlib
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import aiohttp
+from aiohttp import ClientResponseError, RequestInfo
+from dotenv import load_dotenv
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from utils.utils import logger
+
+load_dotenv()
+
+HTTP_ARCHIVE_PATH = os.getenv("HTTP_ARCHIVE_PATH")
+SCAN_CHUNK_SIZE = 64 * 1024
+
+
+class ArchivedResponse:
+    """Stands in for an aiohttp response, built from an archive record."""
+
+    def __init__(self, url: str, status: int, headers: dict, body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            # A real RequestInfo, str(error) needs its URL when callers log it
+            request_info = RequestInfo(URL(self.url), "GET", CIMultiDictProxy(CIMultiDict()), URL(self.url))
+            raise ClientResponseError(
+                request_info, (), status=self.status, message=f"HTTP {self.status}", headers=self.headers
+            )
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self) -> str:
+        charset = "utf-8"
+        content_type = self.headers.get("Content-Type", "")
+        if "charset=" in content_type:
+            charset = content_type.split("charset=")[-1].split(";")[0].strip()
+        return self.body.decode(charset, errors="replace")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+def encode_record(url: str, status: int, headers: dict, body: bytes) -> bytes:
+    """
+    One archive record = one gzip member (like .warc.gz).
+    Member content: JSON header line + "\n" + raw body.
+    """
+    header = {
+        "type": "response",
+        "url": url,
+        "date": datetime.utcnow().isoformat(),
+        "status": status,
+        "headers": headers,
+        "length": len(body),
+    }
+    return gzip.compress(json.dumps(header).encode("utf-8") + b"\n" + body)
+
+
+def decode_record(member: bytes) -> ArchivedResponse:
+    raw = gzip.decompress(member)
+    header_line, body = raw.split(b"\n", 1)
+    header = json.loads(header_line)
+    return ArchivedResponse(header["url"], header["status"], header["headers"], body)
+
+
+def scan_index(data: bytes) -> dict:
+    """Rebuild {url: (offset, length)} by walking the gzip members."""
+    index = {}
+    view = memoryview(data)  # Slices without copying
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        head = b""
+        position = offset
+        # Feed fixed-size chunks until this member ends, so each byte is read once.
+        while not decompressor.eof:
+            chunk = view[position:position + SCAN_CHUNK_SIZE]
+            if not chunk:
+                logger.warning(f"Truncated archive record at offset {offset}, ignoring the rest")
+                return index
+            out = decompressor.decompress(chunk)
+            if b"\n" not in head:
+                head += out
+            position += len(chunk)
+
+        length = position - offset - len(decompressor.unused_data)
+        header = json.loads(head.split(b"\n", 1)[0])
+        index[header["url"]] = (offset, length)  # Latest record wins
+        offset += length
+    return index
+
+
+class RecordingSession:
+    """Wraps an aiohttp session and appends every response to the archive."""
+
+    def __init__(self, session: aiohttp.ClientSession, path: str):
+        self.session = session
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @asynccontextmanager
+    async def get(self, url, **kwargs):
+        async with self.session.get(url, **kwargs) as response:
+            body = await response.read()
+            status = response.status
+            headers = dict(response.headers)
+
+        record = encode_record(url, status, headers, body)
+        # No awaits between the two appends, so records never interleave.
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            f.write(record)
+        with open(self.path + ".idx", "a", encoding="utf-8") as f:
+            f.write(json.dumps({"url": url, "offset": offset, "length": len(record)}) + "\n")
+
+        yield ArchivedResponse(url, status, headers, body)
+
+
+class ReplaySession:
+    """Serves responses from an archive held in memory. No network access."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.data = f.read()
+        self.index = self._load_index(path)
+        logger.info(f"Replaying {len(self.index)} archived URLs from {path}")
+
+    def _load_index(self, path: str) -> dict:
+        index_path = path + ".idx"
+        if not os.path.exists(index_path):
+            return scan_index(self.data)
+
+        index = {}
+        with open(index_path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                index[entry["url"]] = (entry["offset"], entry["length"])
+        # Index is stale (e.g. crash mid-write), fall back to a scan.
+        if index and max(o + n for o, n in index.values()) != len(self.data):
+            return scan_index(self.data)
+        return index
+
+    def get(self, url, **kwargs):
+        if url not in self.index:
+            logger.warning(f"{url} not in archive")
+            return ArchivedResponse(url, 404, {}, b"")
+        offset, length = self.index[url]
+        return decode_record(self.data[offset:offset + length])
+
+
+@asynccontextmanager
+async def open_session(archive_mode: str = None, path: str = HTTP_ARCHIVE_PATH):
+    """
+    Session for a crawl.
+    - None -> live aiohttp session
+    - "record" -> live session, responses appended to the archive
+    - "replay" -> served from the archive only
+    """
+    if archive_mode == "replay":
+        yield ReplaySession(path)
+        return
+
+    async with aiohttp.ClientSession() as session:
+        if archive_mode == "record":
+            yield RecordingSession(session, path)
+        else:
+            yield session
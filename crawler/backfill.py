@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from crawler.get_book_metadata import parse_book_html
+from db.db import (
+    DB, COLLECTION, CHANGELOG_COLLECTION,
+    build_change_entry, bump_catalog_version, get_backfill_checkpoint, save_backfill_checkpoint,
+)
+from utils.utils import build_changed_content, compute_hash, logger
+
+load_dotenv()
+
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE"))
+
+# Fields that describe the crawl or are owned by other stages, not parsed from the page.
+NOT_PARSED_FIELDS = {
+    "raw_html", "crawl_timestamp", "created_at", "updated_at",
+    "status", "content_hash", "image_file",
+}
+
+
+def reparse_doc(doc):
+    """
+    Reparse a stored book's raw_html with the current parser.
+    Returns None if nothing changed, otherwise the fields to $set and their diff.
+    """
+    book = parse_book_html(doc["raw_html"], doc["source_url"])
+    new_doc = book.model_dump(mode="json", exclude=NOT_PARSED_FIELDS)
+    new_doc["content_hash"] = compute_hash(new_doc)
+
+    updates = {field: value for field, value in new_doc.items() if doc.get(field) != value}
+    if not updates:
+        return None
+
+    return {
+        "_id": doc["_id"],
+        "name": new_doc["name"],
+        "source_url": new_doc["source_url"],
+        "updates": updates,
+        "diff": {field: {"old": doc.get(field), "new": value} for field, value in updates.items()},
+        "changes": build_changed_content(new_doc, doc),
+    }
+
+
+def reparse_batch(docs):
+    """Worker entry point: reparse a chunk of docs, keeping only changes and errors."""
+    results = []
+    for doc in docs:
+        try:
+            result = reparse_doc(doc)
+        except Exception as e:
+            result = {"_id": doc["_id"], "source_url": doc.get("source_url"), "error": str(e)}
+        if result:
+            results.append(result)
+    return results
+
+
+async def process_batch(db, pool, workers, batch, stats, dry_run, changelog):
+    """Reparse one cursor batch across the pool and write it back in bulk."""
+    loop = asyncio.get_running_loop()
+    chunks = [batch[i::workers] for i in range(workers)]
+    chunk_results = await asyncio.gather(
+        *(loop.run_in_executor(pool, reparse_batch, chunk) for chunk in chunks if chunk)
+    )
+
+    now = datetime.utcnow()
+    operations = []
+    entries = []
+    for result in (r for results in chunk_results for r in results):
+        if "error" in result:
+            stats["errors"] += 1
+            logger.error(f"Error reparsing {result['source_url']}: {result['error']}")
+            continue
+
+        stats["changed"] += 1
+        if dry_run:
+            logger.info(f"[DRY RUN] '{result['name']}' -> {result['diff']}")
+            continue
+
+        operations.append(UpdateOne(
+            {"_id": result["_id"]},
+            {"$set": {**result["updates"], "updated_at": now}},
+        ))
+        if changelog and result["changes"]:
+            entries.append(build_change_entry(result, "update", result["changes"]))
+
+    stats["scanned"] += len(batch)
+    if dry_run:
+        return
+
+    if operations:
+        await db[COLLECTION].bulk_write(operations, ordered=False)
+    if entries:
+        await db[CHANGELOG_COLLECTION].insert_many(entries)
+    await save_backfill_checkpoint(db, batch[-1]["_id"])
+
+
+async def run_backfill(db, dry_run=False, changelog=False, workers=None,
+                       batch_size=BACKFILL_BATCH_SIZE, restart=False):
+    """
+    Reparse every stored book from raw_html and write back what changed.
+    - Streams the collection in _id order, checkpointing after each batch
+    - dry_run -> only log the diffs, nothing is written
+    - changelog -> also log "update" entries for tracked field changes
+    """
+    workers = workers or os.cpu_count()
+    checkpoint = None if restart or dry_run else await get_backfill_checkpoint(db)
+
+    query = {"raw_html": {"$ne": None}}
+    if checkpoint is not None:
+        query["_id"] = {"$gt": checkpoint}
+    cursor = db[COLLECTION].find(query).sort("_id", 1).batch_size(batch_size)
+
+    stats = {"scanned": 0, "changed": 0, "errors": 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                await process_batch(db, pool, workers, batch, stats, dry_run, changelog)
+                batch = []
+        if batch:
+            await process_batch(db, pool, workers, batch, stats, dry_run, changelog)
+
+    if not dry_run:
+        await save_backfill_checkpoint(db, None)  # Finished, next run starts over
+        if stats["changed"]:
+            await bump_catalog_version(db)
+    logger.info(f"Backfill finished: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reparse stored book pages without recrawling.")
+    parser.add_argument(
+        "--dry-run",
+        type=bool,
+        help="Only log what would change."
+    )
+    parser.add_argument(
+        "--changelog",
+        type=bool,
+        help="Write changelog entries for tracked field changes."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Parser processes. Default: CPU count"
+    )
+    parser.add_argument(
+        "--restart",
+        type=bool,
+        help="Ignore the checkpoint of an interrupted run."
+    )
+    args = parser.parse_args()
+
+    asyncio.run(run_backfill(DB, args.dry_run, args.changelog, args.workers, restart=args.restart))
@@ -1,14 +1,17 @@
 import asyncio
 import os
+import time
 from datetime import datetime
 
 import pandas as pd
-from aiohttp import ClientSession
+from aiohttp import ClientError, ClientResponseError, ClientSession
 from bs4 import BeautifulSoup
 
-from db.db import save_book, save_progress, fetch_changes_for_day
-from crawler.get_book_metadata import parse_book_html
-from utils.utils import flatten_changes, logger
+from db.db import save_book, save_observations, save_progress, fetch_changes_for_day
+from crawler.fetch_control import FetchControl, is_retryable_status, parse_retry_after
+from crawler.get_book_metadata import parse_book_fields
+from db.models import Book
+from utils.utils import compute_hash, flatten_changes, logger
 
 from dotenv import load_dotenv
 
@@ -19,18 +22,43 @@ BASE_URL = os.getenv("BASE_URL")
 MAX_RETRIES = int(os.getenv("MAX_RETRIES"))
 
 
-async def fetch(session: ClientSession, url: str, retries=MAX_RETRIES) -> str:
-    """Fetches a URL with retry logic."""
+async def fetch(session: ClientSession, url: str, retries=MAX_RETRIES, control: FetchControl = None,
+                headers: dict = None, read=None):
+    """
+    Fetches a URL with retry logic. Returns the body text, or `await read(response)` if given.
+    - 429/5xx/timeouts -> jittered exponential backoff, honoring Retry-After
+    - Other 4xx (e.g. 404) -> raised right away as ClientResponseError
+    Concurrency, the retry budget and the circuit breaker are shared through `control`.
+    """
+    control = control or FetchControl()
+    request_kwargs = {"headers": headers} if headers else {}
     for attempt in range(1, retries + 1):
-        try:
-            async with session.get(url, timeout=15) as response:
-                response.raise_for_status()
-                return await response.text()
-        except Exception as e:
-            logger.warning(f"Attempt {attempt} failed for {url}: {e}")
-            if attempt == retries:
-                raise
-            await asyncio.sleep(2 * attempt)  # backoff
+        await control.breaker.wait()
+        async with control.limiter:
+            start = time.monotonic()
+            try:
+                async with session.get(url, timeout=15, **request_kwargs) as response:
+                    response.raise_for_status()
+                    result = await read(response) if read else await response.text()
+                control.on_success(time.monotonic() - start)
+                return result
+            except ClientResponseError as e:
+                if not is_retryable_status(e.status):
+                    control.on_success(time.monotonic() - start)  # Origin is healthy
+                    raise
+                error = e
+                control.on_failure(parse_retry_after(e.headers))
+            except (ClientError, asyncio.TimeoutError) as e:
+                error = e
+                control.on_failure()
+
+        logger.warning(f"Attempt {attempt} failed for {url}: {error!r}")
+        if attempt == retries:
+            raise error
+        if not control.take_retry():
+            logger.warning(f"Retry budget exhausted, giving up on {url}")
+            raise error
+        await asyncio.sleep(control.backoff(attempt))
 
 
 async def get_book_links(session, page_html):
@@ -40,31 +68,48 @@ async def get_book_links(session, page_html):
     return [BASE_URL + "/catalogue/" + b["href"] for b in books]
 
 
-async def process_book(session, db, book_url):
-    """Fetch and parse a single book, then save it."""
+async def process_book(session, db, book_url, control=None, hash_index=None):
+    """
+    Fetch and parse a single book, then save it.
+    Books whose fingerprint matches `hash_index` are skipped without touching the DB.
+    Returns the parsed fields, or None if the book failed.
+    """
     try:
-        html = await fetch(session, book_url)
-        book = parse_book_html(html, book_url)
+        html = await fetch(session, book_url, control=control)
+        fields = parse_book_fields(html, book_url)
+        content_hash = compute_hash(fields)
+        if hash_index is not None and hash_index.is_unchanged(book_url, content_hash):
+            logger.info(f"No changes for book: {fields['name']}")
+            return fields
+
+        book = Book(**fields, raw_html=html, crawl_timestamp=datetime.utcnow())
         await save_book(db, book)
+        if hash_index is not None:
+            hash_index.add(book_url, content_hash)
+        return fields
     except Exception as e:
         logger.error(f"Error processing {book_url}: {e}")
+        return None
 
 
-async def crawl_page(session, db, page_number):
+async def crawl_page(session, db, page_number, control=None, hash_index=None):
     """Crawl a single page of book listings."""
     url = BASE_URL+f"catalogue/page-{page_number}.html"
     logger.info(f"Crawling {url}")
     try:
-        page_html = await fetch(session, url)
-    except Exception as e:
+        page_html = await fetch(session, url, control=control)
+    except ClientResponseError as e:
         # Detect "end of pagination"
-        if "404" in str(e) or "Not Found" in str(e):
+        if e.status == 404:
             await save_progress(db, 1)
             logger.info(f"No next page found at {url}. Resetting progress to 1.")
             return False  # Stop crawling gracefully
 
         logger.error(f"Failed to crawl {url}: {e}")
         return False
+    except Exception as e:
+        logger.error(f"Failed to crawl {url}: {e}")
+        return False
 
     book_links = await get_book_links(session, page_html)
     if not book_links:
@@ -75,8 +120,14 @@ async def crawl_page(session, db, page_number):
 
     tasks = []
     for link in book_links:
-        tasks.append(process_book(session, db, link))
-    await asyncio.gather(*tasks)
+        tasks.append(process_book(session, db, link, control, hash_index))
+    books = await asyncio.gather(*tasks)
+
+    # One history point per crawled book, changed or not
+    try:
+        await save_observations(db, [b for b in books if b])
+    except Exception as e:
+        logger.error(f"Error saving history for page {page_number}: {e}")
 
     # Save checkpoint after successfully completing this page
     await save_progress(db, page_number)
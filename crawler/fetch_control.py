@@ -0,0 +1,189 @@
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from dotenv import load_dotenv
+
+from utils.utils import logger
+
+load_dotenv()
+
+FETCH_INITIAL_CONCURRENCY = int(os.getenv("FETCH_INITIAL_CONCURRENCY"))
+FETCH_MIN_CONCURRENCY = int(os.getenv("FETCH_MIN_CONCURRENCY"))
+FETCH_MAX_CONCURRENCY = int(os.getenv("FETCH_MAX_CONCURRENCY"))
+FETCH_LATENCY_TARGET_SECONDS = float(os.getenv("FETCH_LATENCY_TARGET_SECONDS"))
+BACKOFF_BASE_SECONDS = float(os.getenv("BACKOFF_BASE_SECONDS"))
+BACKOFF_MAX_SECONDS = float(os.getenv("BACKOFF_MAX_SECONDS"))
+RETRY_BUDGET = int(os.getenv("RETRY_BUDGET"))
+CIRCUIT_BREAKER_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_THRESHOLD"))
+CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN_SECONDS"))
+
+
+def is_retryable_status(status: int) -> bool:
+    """429 and 5xx mean the origin is overloaded. Other 4xx won't change on retry."""
+    return status == 429 or status >= 500
+
+
+def parse_retry_after(headers) -> float | None:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds."""
+    value = headers.get("Retry-After") if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter.
+    - Fast success -> limit grows by ~1 per `limit` requests (additive increase)
+    - Slow success -> limit holds
+    - 429/5xx/timeout -> limit halves, at most once per latency window (multiplicative decrease)
+    """
+
+    def __init__(
+        self,
+        initial=FETCH_INITIAL_CONCURRENCY,
+        minimum=FETCH_MIN_CONCURRENCY,
+        maximum=FETCH_MAX_CONCURRENCY,
+        latency_target=FETCH_LATENCY_TARGET_SECONDS,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        if latency <= self.latency_target:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        now = time.monotonic()
+        # Failures from one burst of in-flight requests only count once.
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit / 2)
+        logger.warning(f"Origin overloaded, concurrency limit lowered to {int(self.limit)}")
+
+
+class CircuitBreaker:
+    """
+    Pauses all fetches when the origin keeps failing.
+    - closed -> requests flow, consecutive failures are counted
+    - open -> everyone waits for the cooldown (or Retry-After)
+    - half-open -> one probe request goes through, the rest wait for its result
+    """
+
+    def __init__(self, threshold=CIRCUIT_BREAKER_THRESHOLD, cooldown=CIRCUIT_BREAKER_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.tripped = False  # Needs a successful probe before closing again
+        self._probe = None  # Set when the in-flight probe reports back
+
+    async def wait(self):
+        """Block while the circuit is open or a half-open probe is in flight."""
+        while True:
+            delay = self.open_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if not self.tripped:
+                return
+            if self._probe is None:
+                self._probe = asyncio.Event()  # This caller is the probe
+                return
+
+            probe = self._probe
+            try:
+                await asyncio.wait_for(probe.wait(), self.cooldown)
+            except asyncio.TimeoutError:
+                # The probe never reported back, let another request try.
+                if self._probe is probe:
+                    self._finish_probe()
+
+    def pause(self, seconds: float):
+        """Open the circuit for `seconds`. Requests resume through a single probe."""
+        self.open_until = max(self.open_until, time.monotonic() + seconds)
+        self.tripped = True
+        self._finish_probe()
+
+    def on_success(self):
+        self.failures = 0
+        self.tripped = False
+        self._finish_probe()
+
+    def on_failure(self):
+        self.failures += 1
+        probe_failed = self._probe is not None
+        if probe_failed or (not self.tripped and self.failures >= self.threshold):
+            self.pause(self.cooldown)
+            logger.warning(f"Circuit open after repeated failures. Pausing crawl for {self.cooldown}s.")
+
+    def _finish_probe(self):
+        if self._probe is not None:
+            self._probe.set()
+            self._probe = None
+
+
+class FetchControl:
+    """Crawl-scoped fetch state: concurrency limiter, circuit breaker and retry budget."""
+
+    def __init__(self, retry_budget=RETRY_BUDGET, limiter=None, breaker=None):
+        self.retries_left = retry_budget
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+
+    def on_success(self, latency: float):
+        self.limiter.on_success(latency)
+        self.breaker.on_success()
+
+    def on_failure(self, retry_after: float = None):
+        self.limiter.on_overload()
+        self.breaker.on_failure()
+        if retry_after:
+            # Never let one header park the crawl for longer than a breaker cooldown.
+            if retry_after > self.breaker.cooldown:
+                logger.warning(
+                    f"Retry-After of {retry_after}s exceeds the breaker cooldown. "
+                    f"Pausing for {self.breaker.cooldown}s instead."
+                )
+                retry_after = self.breaker.cooldown
+            self.breaker.pause(retry_after)
+
+    def take_retry(self) -> bool:
+        """Spend one retry from the crawl-wide budget."""
+        if self.retries_left <= 0:
+            return False
+        self.retries_left -= 1
+        return True
+
+    @staticmethod
+    def backoff(attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
@@ -12,7 +12,8 @@ load_dotenv()
 RATING_MAPPING = json.loads(os.getenv("RATING_MAPPING"))
 
 
-def parse_book_html(html: str, url: str) -> Book:
+def parse_book_fields(html: str, url: str) -> dict:
+    """Extract the book fields from a page, without building a Book model."""
     soup = BeautifulSoup(html, "html.parser")
 
     name = soup.find("h1").get_text(strip=True)
@@ -33,18 +34,23 @@ def parse_book_html(html: str, url: str) -> Book:
     rating_class = soup.find("p", class_="star-rating")["class"]
     rating = RATING_MAPPING.get(rating_class[1], 0) if len(rating_class) > 1 else 0
 
+    return {
+        "name": name,
+        "description": description,
+        "category": category,
+        "price_excl_tax": price_excl,
+        "price_incl_tax": price_incl,
+        "availability": availability,
+        "number_of_reviews": reviews,
+        "image_url": image_url,
+        "rating": rating,
+        "source_url": url,
+    }
+
 
+def parse_book_html(html: str, url: str) -> Book:
     return Book(
-        name=name,
-        description=description,
-        category=category,
-        price_excl_tax=price_excl,
-        price_incl_tax=price_incl,
-        availability=availability,
-        number_of_reviews=reviews,
-        image_url=image_url,
-        rating=rating,
-        source_url=url,
+        **parse_book_fields(html, url),
         raw_html=html,
         crawl_timestamp=datetime.utcnow(),
-    )
\ No newline at end of file
+    )
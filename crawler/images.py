@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+from datetime import datetime
+
+from aiohttp import ClientSession
+from dotenv import load_dotenv
+
+from crawler.crawler import fetch
+from crawler.fetch_control import FetchControl
+from db.db import COLLECTION, IMAGE_COLLECTION
+from utils.utils import logger
+
+load_dotenv()
+
+IMAGE_DIR = os.getenv("IMAGE_DIR")
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY"))
+
+
+def image_file_name(content: bytes, content_type: str = None) -> str:
+    """
+    Content-addressed file name: '<sha256 of bytes><ext>'.
+    The extension only comes from the content type, so the same bytes under
+    '.jpg', '.jpeg' or extension-less URLs map to one file.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    ext = ""
+    if content_type:
+        ext = mimetypes.guess_extension(content_type.split(";")[0].strip().lower()) or ""
+    return digest + ext
+
+
+def store_image(content: bytes, file_name: str) -> bool:
+    """
+    Write image bytes to IMAGE_DIR once.
+    Returns False if the same content is already stored.
+    """
+    path = os.path.join(IMAGE_DIR, file_name)
+    if os.path.exists(path):
+        return False
+
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)  # Atomic, readers never see partial files
+    return True
+
+
+async def link_books(db, image_url: str, file_name: str):
+    """Point every book using `image_url` at the mirrored file, if it isn't already."""
+    await db[COLLECTION].update_many(
+        {"image_url": image_url, "image_file": {"$ne": file_name}},
+        {"$set": {"image_file": file_name}},
+    )
+
+
+async def read_image(response):
+    return response.status, response.headers, await response.read()
+
+
+async def mirror_image(session: ClientSession, db, image_url: str, control: FetchControl = None):
+    """
+    Download (or revalidate) a single cover image.
+    - Known image -> conditional GET, 304 keeps the stored copy
+    - New/changed image -> store by content hash + point books at it
+    """
+    record = await db[IMAGE_COLLECTION].find_one({"_id": image_url})
+    headers = {}
+    # Only revalidate when the stored copy is still on disk.
+    if record and os.path.exists(os.path.join(IMAGE_DIR, record["image_file"])):
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+
+    status, response_headers, content = await fetch(
+        session, image_url, control=control, headers=headers, read=read_image
+    )
+    if status == 304:
+        # Unchanged, but books inserted since the last run may still lack image_file
+        await link_books(db, image_url, record["image_file"])
+        return record["image_file"]
+    etag = response_headers.get("ETag")
+    last_modified = response_headers.get("Last-Modified")
+    content_type = response_headers.get("Content-Type")
+
+    file_name = image_file_name(content, content_type)
+    if store_image(content, file_name):
+        logger.info(f"Mirrored image {image_url} -> {file_name}")
+
+    await db[IMAGE_COLLECTION].update_one(
+        {"_id": image_url},
+        {
+            "$set": {
+                "image_file": file_name,
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": datetime.utcnow(),
+            }
+        },
+        upsert=True,
+    )
+    await link_books(db, image_url, file_name)
+    return file_name
+
+
+async def mirror_images(session: ClientSession, db, control: FetchControl = None, concurrency=IMAGE_CONCURRENCY):
+    """
+    Mirror all distinct cover images.
+    Downloads share the crawl's FetchControl (adaptive limit, retry budget, breaker),
+    `concurrency` only caps how many images are in progress at once.
+    """
+    control = control or FetchControl()
+    image_urls = await db[COLLECTION].distinct("image_url")
+    logger.info(f"Mirroring {len(image_urls)} cover images...")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker(image_url):
+        async with semaphore:
+            try:
+                await mirror_image(session, db, image_url, control)
+            except Exception as e:
+                logger.error(f"Error mirroring image {image_url}: {e}")
+
+    await asyncio.gather(*(worker(url) for url in image_urls))
+    logger.info("Image mirroring finished.")
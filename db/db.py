@@ -3,9 +3,12 @@ from datetime import datetime, timedelta
 
 import motor.motor_asyncio
 from dotenv import load_dotenv
+from pymongo import UpdateOne
 
 from db.models import Book
-from utils.utils import compute_hash, build_changed_content, logger
+from utils.utils import (
+    HashIndex, build_observation, compute_hash, build_changed_content, logger, normalize_url,
+)
 
 load_dotenv()
 
@@ -14,7 +17,10 @@ DB_NAME = os.getenv("DB_NAME")
 COLLECTION = os.getenv("COLLECTION")
 PROGRESS_COLLECTION = os.getenv("PROGRESS_COLLECTION")
 CHANGELOG_COLLECTION = os.getenv("CHANGELOG_COLLECTION")
+IMAGE_COLLECTION = os.getenv("IMAGE_COLLECTION")
+HISTORY_COLLECTION = os.getenv("HISTORY_COLLECTION")
 CRAWLER_NAME = os.getenv("CRAWLER_NAME")
+CATALOG_VERSION_ID = f"{CRAWLER_NAME}_catalog_version"
 
 
 CLIENT = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
@@ -30,7 +36,8 @@ async def save_book(db, book: Book):
     """
     # Convert Pydantic model into a Mongo-friendly.
     # Ensures all special types (HttpUrl, datetime, Decimal, etc.) are serialized to JSON-safe primitives (strings, numbers)
-    doc = book.model_dump(mode="json")
+    # image_file is owned by the image mirror stage, never overwrite it here.
+    doc = book.model_dump(mode="json", exclude={"image_file"})
 
     # Compute hash and append to content
     content_hash = compute_hash(doc)
@@ -67,6 +74,41 @@ async def save_book(db, book: Book):
     logger.info(f"Updated book: {doc['name']}")
 
 
+async def load_hash_index(db) -> HashIndex:
+    """Load source_url -> content_hash for every stored book in one projected query."""
+    index = HashIndex()
+    cursor = db[COLLECTION].find({}, {"source_url": 1, "content_hash": 1, "_id": 0})
+    async for doc in cursor:
+        if doc.get("content_hash"):
+            index.add(doc["source_url"], doc["content_hash"])
+    logger.info(f"Loaded content hashes for {len(index)} books.")
+    return index
+
+
+async def save_observations(db, books):
+    """
+    Append one price/stock/rating point per crawled book to its history.
+    Points are bucketed into one document per book per month, written in a single bulk call.
+    """
+    if not books:
+        return
+    now = datetime.utcnow()
+    bucket_start = datetime(now.year, now.month, 1)
+    operations = [
+        UpdateOne(
+            # Same form as the books collection's source_url, which the history endpoint looks up
+            {"book_url": normalize_url(book["source_url"]), "bucket_start": bucket_start},
+            {
+                "$push": {"points": build_observation(book, now)},
+                "$inc": {"count": 1},
+            },
+            upsert=True,
+        )
+        for book in books
+    ]
+    await db[HISTORY_COLLECTION].bulk_write(operations, ordered=False)
+
+
 async def get_last_page(db):
     """Read last crawled page number from MongoDB."""
     progress = await db[PROGRESS_COLLECTION].find_one({"_id": CRAWLER_NAME})
@@ -91,20 +133,63 @@ async def save_progress(db, page_number):
     )
 
 
-async def log_change(db, book_doc, change_type, changes):
+def build_change_entry(book_doc, change_type, changes):
     """
-    Insert a row in the change-log collection.
+    Build a row for the change-log collection.
 
     change_type: "new" or "update"
     changes: {field_name: {"old": old_val, "new": new_val}}
     """
-    payload = {
+    return {
         "book_url": str(book_doc.get("source_url")),
         "book_name": book_doc.get("name"),
         "change_type": change_type,
         "changes": changes,
         "changed_at": datetime.utcnow(),
     }
+
+
+async def bump_catalog_version(db):
+    """Tell API snapshots that stored books changed."""
+    await db[PROGRESS_COLLECTION].update_one(
+        {"_id": CATALOG_VERSION_ID},
+        {
+            "$inc": {"version": 1},
+            "$set": {"updated_at": datetime.utcnow()},
+        },
+        upsert=True,
+    )
+
+
+async def get_backfill_checkpoint(db):
+    """Read the last backfilled book _id, if a previous run was interrupted."""
+    progress = await db[PROGRESS_COLLECTION].find_one({"_id": f"{CRAWLER_NAME}_backfill"})
+    if progress:
+        logger.info(f"Resuming backfill after _id {progress['last_id']}...")
+        return progress["last_id"]
+    return None
+
+
+async def save_backfill_checkpoint(db, last_id):
+    """Save the last backfilled book _id. None clears the checkpoint."""
+    if last_id is None:
+        await db[PROGRESS_COLLECTION].delete_one({"_id": f"{CRAWLER_NAME}_backfill"})
+        return
+    await db[PROGRESS_COLLECTION].update_one(
+        {"_id": f"{CRAWLER_NAME}_backfill"},
+        {
+            "$set": {
+                "last_id": last_id,
+                "updated_at": datetime.utcnow(),
+            }
+        },
+        upsert=True,
+    )
+
+
+async def log_change(db, book_doc, change_type, changes):
+    """Insert a row in the change-log collection."""
+    payload = build_change_entry(book_doc, change_type, changes)
     await db[CHANGELOG_COLLECTION].insert_one(payload)
 
     # Alerting line to the log.
@@ -114,6 +199,11 @@ async def log_change(db, book_doc, change_type, changes):
     )
 
 
+async def count_changes_since(db, since: datetime):
+    """Number of change log entries written since `since`."""
+    return await db[CHANGELOG_COLLECTION].count_documents({"changed_at": {"$gte": since}})
+
+
 async def fetch_changes_for_day(target_date: datetime):
     """Fetch all change log entries for the given date (UTC) from MongoDB."""
     start = datetime(target_date.year, target_date.month, target_date.day)
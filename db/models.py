@@ -12,6 +12,7 @@ class Book(BaseModel):
     availability: str
     rating: int
     image_url: HttpUrl
+    image_file: Optional[str] = None # Mirrored cover, served from /images/{image_file}
     number_of_reviews: str
     source_url: HttpUrl
     raw_html: Optional[str] = None
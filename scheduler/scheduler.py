@@ -1,13 +1,16 @@
 import argparse
 import asyncio
 import os
+from datetime import datetime
 
-import aiohttp
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 
+from crawler.archive import open_session
 from crawler.crawler import crawl_page, generate_daily_report
-from db.db import DB, get_last_page
+from crawler.fetch_control import FetchControl
+from crawler.images import mirror_images
+from db.db import DB, bump_catalog_version, count_changes_since, get_last_page, load_hash_index
 from utils.utils import logger
 
 load_dotenv()
@@ -16,23 +19,33 @@ SCHEDULER_CRAWL_HOUR = int(os.getenv("SCHEDULER_CRAWL_HOUR"))
 SCHEDULER_CRAWL_MINUTE = int(os.getenv("SCHEDULER_CRAWL_MINUTE"))
 
 
-async def run_crawl(generate_report, report_format):
+async def run_crawl(generate_report, report_format, mirror=False, archive_mode=None):
     logger.info("Starting scheduled crawl...")
-    async with aiohttp.ClientSession() as session:
+    started_at = datetime.utcnow()
+    control = FetchControl()  # Shared limiter, breaker and retry budget for this crawl
+    hash_index = await load_hash_index(DB)  # Unchanged books skip the DB entirely
+    async with open_session(archive_mode) as session:
         page = await get_last_page(DB)
         while True:
-            success = await crawl_page(session, DB, page)
+            success = await crawl_page(session, DB, page, control, hash_index)
             if not success:
                 break
             page += 1
-    logger.info("Scheduled crawl finished.")
+        logger.info("Scheduled crawl finished.")
+
+        if mirror:
+            await mirror_images(session, DB, control)
+
+    # Let API snapshots know they need to reload
+    if mirror or await count_changes_since(DB, started_at):
+        await bump_catalog_version(DB)
 
     if generate_report:
         await generate_daily_report(report_format)
         logger.info("Daily change report generated successfully.")
 
 
-def start_scheduler(generate_report, report_format):
+def start_scheduler(generate_report, report_format, mirror=False, archive_mode=None):
     """
     Start the APScheduler AsyncIO scheduler.
     This is the main entry point for the project.
@@ -40,7 +53,7 @@ def start_scheduler(generate_report, report_format):
     scheduler = AsyncIOScheduler()
     scheduler.add_job(run_crawl, "cron",
                       hour=SCHEDULER_CRAWL_HOUR, minute=SCHEDULER_CRAWL_MINUTE,
-                      args=[generate_report, report_format])
+                      args=[generate_report, report_format, mirror, archive_mode])
     scheduler.start()
 
     logger.info("Scheduler started. Waiting for jobs...")
@@ -63,6 +76,16 @@ if __name__ == "__main__":
         default="csv",
         help="Format for the daily change report (csv or json). Default: csv"
     )
+    parser.add_argument(
+        "--mirror-images",
+        type=bool,
+        help="Download cover images to IMAGE_DIR after each crawl."
+    )
+    parser.add_argument(
+        "--archive-mode",
+        choices=["record", "replay"],
+        help="Record responses to HTTP_ARCHIVE_PATH, or replay a crawl from it offline."
+    )
     args = parser.parse_args()
 
-    start_scheduler(args.generate_report, args.report_format)
+    start_scheduler(args.generate_report, args.report_format, args.mirror_images, args.archive_mode)
@@ -1,12 +1,89 @@
+import asyncio
+import json
 import os
+import tempfile
+import time
 import unittest
 from datetime import datetime
-from unittest.mock import patch, AsyncMock
+from unittest.mock import patch, AsyncMock, MagicMock
 
-from crawler import get_book_metadata, crawler
+from aiohttp import ClientResponseError
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from api import api, models as api_models, snapshot, utils as api_utils
+from crawler import archive, backfill, get_book_metadata, crawler, fetch_control, images
 from db import models, db
 from utils import utils
 
+BOOK_HTML = """
+            <html>
+              <h1>Book Title</h1>
+              <div id="product_description"></div>
+              <p>Description text here.</p>
+              <table>
+                <tr><th>Price (excl. tax)</th><td>£10.00</td></tr>
+                <tr><th>Price (incl. tax)</th><td>£12.00</td></tr>
+                <tr><th>Availability</th><td>In stock</td></tr>
+                <tr><th>Number of reviews</th><td>5</td></tr>
+              </table>
+              <img src="../../media/test.jpg">
+              <p class="star-rating Four"></p>
+              <ul class="breadcrumb">
+                <li></li><li></li><li><a>Fiction</a></li>
+              </ul>
+            </html>
+            """
+
+
+def eval_mongo_expr(expr, doc):
+    """Evaluate the small subset of aggregation expressions used by the /books pipeline."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        return doc.get(expr[1:])
+    if not isinstance(expr, dict):
+        return expr
+    ((op, arg),) = expr.items()
+    if op in ("$replaceAll", "$trim"):
+        value = eval_mongo_expr(arg["input"], doc)
+        if value is None:
+            return None
+        return value.replace(arg["find"], arg["replacement"]) if op == "$replaceAll" else value.strip()
+    if op == "$convert":
+        value = eval_mongo_expr(arg["input"], doc)
+        if value is None:
+            return arg["onNull"]
+        try:
+            return {"double": float, "int": int}[arg["to"]](value)
+        except ValueError:
+            return arg["onError"]
+    raise NotImplementedError(op)
+
+
+class FakeAggregateCursor:
+    """Runs a $match({})/$addFields/$sort/$skip/$limit/$project pipeline in memory."""
+
+    def __init__(self, docs, pipeline):
+        self.docs = [dict(d) for d in docs]
+        self.pipeline = pipeline
+
+    async def to_list(self, length=None):
+        docs = self.docs
+        for stage in self.pipeline:
+            ((op, arg),) = stage.items()
+            if op == "$match":
+                assert arg == {}, "Only unfiltered pipelines are supported"
+            elif op == "$addFields":
+                docs = [{**d, **{k: eval_mongo_expr(v, d) for k, v in arg.items()}} for d in docs]
+            elif op == "$sort":
+                docs = sorted(docs, key=lambda d: tuple(d[k] for k in arg))
+            elif op == "$skip":
+                docs = docs[arg:]
+            elif op == "$limit":
+                docs = docs[:arg]
+            elif op == "$project":
+                docs = [{k: d[k] for k, v in arg.items() if v and k in d} for d in docs]
+        return docs
+
 
 class TestBookCrawlerProject(unittest.IsolatedAsyncioTestCase):
     def test_build_fingerprint_and_hash(self):
@@ -136,6 +213,518 @@ class TestBookCrawlerProject(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(first, second)
         self.assertTrue(len(first) == 64)
 
+    def test_build_projection_defaults_to_summary(self):
+        projection = api_utils.build_projection(None)
+        self.assertNotIn("raw_html", projection)
+        self.assertNotIn("description", projection)
+        self.assertEqual(projection["name"], 1)
+        self.assertEqual(projection["_id"], 0)
+
+        projection = api_utils.build_projection("name, rating")
+        self.assertEqual(projection, {"name": 1, "rating": 1, "_id": 0})
+
+        with self.assertRaises(HTTPException) as ctx:
+            api_utils.build_projection("name,secret")
+        self.assertEqual(ctx.exception.status_code, 400)
+
+    async def test_list_books_uses_projection_and_price_filter(self):
+        """Ensure list_books projects fields and filters price before pagination."""
+        cursor = MagicMock()
+        cursor.to_list = AsyncMock(return_value=[{"name": "Cheap"}])
+        fake_collection = MagicMock()
+        fake_collection.aggregate.return_value = cursor
+        fake_collection.count_documents = AsyncMock(return_value=1)
+
+        with patch("api.api.DB", {db.COLLECTION: fake_collection}):
+            response = await api.list_books(
+                category=None, min_price=None, max_price=10, rating=None,
+                sort_by="rating", page=1, page_size=20, fields="name",
+            )
+
+        (pipeline,) = fake_collection.aggregate.call_args.args
+        filters, projection = pipeline[0]["$match"], pipeline[-1]["$project"]
+        self.assertEqual(projection, {"name": 1, "_id": 0})
+        self.assertEqual(filters["$expr"], api_utils.build_price_filter(None, 10))
+        fake_collection.count_documents.assert_awaited_with(filters)  # Total counts the price filter
+        body = json.loads(response.body)
+        self.assertEqual(body["total"], 1)
+        self.assertEqual(body["items"], [{"name": "Cheap"}])
+
+    def test_build_price_filter(self):
+        self.assertIsNone(api_utils.build_price_filter(None, None))
+        price_filter = api_utils.build_price_filter(5, 10)
+        self.assertEqual([list(c)[0] for c in price_filter["$and"]], ["$gte", "$lte"])
+        self.assertEqual(price_filter["$and"][0]["$gte"][1], 5)
+        self.assertEqual(price_filter["$and"][1]["$lte"][1], 10)
+
+    def test_list_books_query_params_over_http(self):
+        """Query strings are converted to numbers before reaching list_books."""
+        cursor = MagicMock()
+        cursor.to_list = AsyncMock(return_value=[{"name": "Cheap", "price_incl_tax": "£5.00"}])
+        fake_collection = MagicMock()
+        fake_collection.aggregate.return_value = cursor
+        fake_collection.count_documents = AsyncMock(return_value=1)
+
+        with patch("api.api.DB", {db.COLLECTION: fake_collection}):
+            client = TestClient(api.app)
+            headers = {"X-API-Key": api_utils.API_KEY}
+            response = client.get("/books?max_price=10&rating=2&page=2&page_size=5", headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["page"], 2)
+        (pipeline,) = fake_collection.aggregate.call_args.args
+        self.assertIn({"$skip": 5}, pipeline)
+
+    def test_store_image_is_content_addressed(self):
+        content = b"\xff\xd8fake-jpeg"
+        first = images.image_file_name(content, "image/jpeg")
+        second = images.image_file_name(content, "image/jpeg; charset=binary")
+        self.assertEqual(first, second)
+        self.assertTrue(first.endswith(".jpg"))
+        self.assertTrue(api.IMAGE_FILE_PATTERN.fullmatch(first))
+
+        bare = images.image_file_name(content)  # No content type, no extension
+        self.assertEqual(len(bare), 64)
+        self.assertTrue(api.IMAGE_FILE_PATTERN.fullmatch(bare))
+
+        with tempfile.TemporaryDirectory() as tmp, patch("crawler.images.IMAGE_DIR", tmp):
+            self.assertTrue(images.store_image(content, first))
+            self.assertFalse(images.store_image(content, second))  # Stored once
+            self.assertEqual(os.listdir(tmp), [first])
+
+    async def test_mirror_image_links_books_on_304(self):
+        """A 304 still points books without image_file at the stored copy."""
+        class FakeResponse:
+            def __init__(self, status): self.status = status
+            headers = {}
+            async def read(self): return b""
+            def raise_for_status(self):
+                if self.status >= 400:
+                    raise ClientResponseError(None, (), status=self.status, headers={})
+            async def __aenter__(self): return self
+            async def __aexit__(self, *a): pass
+
+        class FakeSession:
+            statuses = [503, 304]
+            def get(self, url, **kwargs):
+                self.headers = kwargs["headers"]
+                return FakeResponse(self.statuses.pop(0))
+
+        file_name = "a" * 64 + ".jpg"
+        images_collection = MagicMock()
+        images_collection.find_one = AsyncMock(return_value={"image_file": file_name, "etag": '"v1"'})
+        books = MagicMock()
+        books.update_many = AsyncMock()
+        fake_db = {db.IMAGE_COLLECTION: images_collection, db.COLLECTION: books}
+        session = FakeSession()
+
+        with tempfile.TemporaryDirectory() as tmp, patch("crawler.images.IMAGE_DIR", tmp):
+            open(os.path.join(tmp, file_name), "wb").close()
+            control = fetch_control.FetchControl(retry_budget=5)
+            with patch("crawler.fetch_control.BACKOFF_BASE_SECONDS", 0):
+                result = await images.mirror_image(session, fake_db, "https://example.com/c.jpg", control)
+
+        self.assertEqual(result, file_name)
+        self.assertEqual(control.retries_left, 4)  # The 503 retry came from the crawl's budget
+        self.assertEqual(session.headers["If-None-Match"], '"v1"')
+        books.update_many.assert_awaited_with(
+            {"image_url": "https://example.com/c.jpg", "image_file": {"$ne": file_name}},
+            {"$set": {"image_file": file_name}},
+        )
+
+    async def test_get_image_rejects_invalid_names(self):
+        with self.assertRaises(HTTPException) as ctx:
+            await api.get_image("../.env")
+        self.assertEqual(ctx.exception.status_code, 400)
+
+    def test_get_image_skips_gzip_and_honours_if_none_match(self):
+        content = os.urandom(5000)
+        with tempfile.TemporaryDirectory() as tmp, patch("api.api.IMAGE_DIR", tmp):
+            file_name = images.image_file_name(content, "image/jpeg")
+            with open(os.path.join(tmp, file_name), "wb") as f:
+                f.write(content)
+            client = TestClient(api.app)
+            response = client.get(f"/images/{file_name}", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers.get("content-encoding"), "gzip")
+            self.assertEqual(response.content, content)
+
+            etag = response.headers["etag"]
+            cached = client.get(f"/images/{file_name}", headers={"If-None-Match": etag})
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.content, b"")
+            self.assertEqual(cached.headers["etag"], etag)
+
+    async def test_fetch_retries_overload_and_raises_404(self):
+        """Ensure fetch() retries 503s but gives up on a 404 right away."""
+        class FakeResponse:
+            def __init__(self, status): self.status = status
+            async def text(self): return "OK"
+            def raise_for_status(self):
+                if self.status >= 400:
+                    raise ClientResponseError(None, (), status=self.status, headers={"Retry-After": "0"})
+            async def __aenter__(self): return self
+            async def __aexit__(self, *a): pass
+
+        class FakeSession:
+            def __init__(self, statuses): self.statuses = list(statuses)
+            def get(self, url, timeout):
+                return FakeResponse(self.statuses.pop(0))
+
+        control = fetch_control.FetchControl(retry_budget=5)
+        with patch("crawler.fetch_control.BACKOFF_BASE_SECONDS", 0):
+            text = await crawler.fetch(FakeSession([503, 200]), "https://example.com", control=control)
+        self.assertEqual(text, "OK")
+        self.assertEqual(control.retries_left, 4)
+
+        session = FakeSession([404, 200])
+        with self.assertRaises(ClientResponseError) as ctx:
+            await crawler.fetch(session, "https://example.com", control=control)
+        self.assertEqual(ctx.exception.status, 404)
+        self.assertEqual(session.statuses, [200])  # Not retried
+
+    def test_adaptive_limiter_aimd(self):
+        limiter = fetch_control.AdaptiveLimiter(initial=4, minimum=1, maximum=5, latency_target=1)
+        for _ in range(4):
+            limiter.on_success(0.1)
+        self.assertGreater(limiter.limit, 4.9)
+        limiter.on_success(5)  # Slow responses don't grow the limit
+        self.assertLessEqual(limiter.limit, 5)
+
+        limiter.on_overload()
+        limiter.on_overload()  # Same window, only one decrease
+        self.assertAlmostEqual(limiter.limit, limiter.maximum / 2, delta=0.5)
+
+    def test_circuit_breaker_opens_after_threshold(self):
+        breaker = fetch_control.CircuitBreaker(threshold=3, cooldown=30)
+        breaker.on_failure()
+        breaker.on_failure()
+        self.assertEqual(breaker.open_until, 0.0)
+        breaker.on_failure()
+        self.assertGreater(breaker.open_until, 0.0)
+
+        self.assertEqual(fetch_control.parse_retry_after({"Retry-After": "7"}), 7.0)
+        self.assertIsNone(fetch_control.parse_retry_after({}))
+
+    def test_retry_after_is_clamped_to_breaker_cooldown(self):
+        control = fetch_control.FetchControl(breaker=fetch_control.CircuitBreaker(threshold=10, cooldown=30))
+        before = time.monotonic()
+        with self.assertLogs(utils.logger, "WARNING") as logs:
+            control.on_failure(retry_after=86400)
+        self.assertLessEqual(control.breaker.open_until, time.monotonic() + 30)
+        self.assertGreaterEqual(control.breaker.open_until, before + 30)
+        self.assertTrue(any("Pausing for 30s" in line for line in logs.output))
+
+    async def test_circuit_breaker_half_open_lets_one_probe_through(self):
+        breaker = fetch_control.CircuitBreaker(threshold=1, cooldown=0.1)
+        breaker.on_failure()
+        waiters = [asyncio.create_task(breaker.wait()) for _ in range(3)]
+        await asyncio.sleep(0.15)
+        self.assertEqual(sum(w.done() for w in waiters), 1)  # Only the probe
+
+        breaker.on_failure()  # Probe failed -> open again, nobody else released
+        await asyncio.sleep(0.01)
+        self.assertEqual(sum(w.done() for w in waiters), 1)
+        await asyncio.sleep(0.14)
+        self.assertEqual(sum(w.done() for w in waiters), 2)  # Next probe only
+
+        breaker.on_success()  # Probe succeeded -> circuit closed
+        await asyncio.gather(*waiters)
+        self.assertFalse(breaker.tripped)
+
+    async def test_archive_record_then_replay(self):
+        """Responses recorded through fetch() replay offline, with or without the index."""
+        class FakeResponse:
+            status = 200
+            headers = {"Content-Type": "text/html; charset=utf-8"}
+            async def read(self): return "<h1>Caf\u00e9</h1>".encode("utf-8")
+            async def __aenter__(self): return self
+            async def __aexit__(self, *a): pass
+
+        class FakeSession:
+            def get(self, url, **kwargs): return FakeResponse()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "crawl.warc.gz")
+            recorder = archive.RecordingSession(FakeSession(), path)
+            for url in ("https://example.com/a", "https://example.com/b"):
+                self.assertEqual(await crawler.fetch(recorder, url), "<h1>Caf\u00e9</h1>")
+
+            replay = archive.ReplaySession(path)
+            self.assertEqual(await crawler.fetch(replay, "https://example.com/b"), "<h1>Caf\u00e9</h1>")
+            with self.assertRaises(ClientResponseError) as ctx:
+                await crawler.fetch(replay, "https://example.com/missing")
+            self.assertEqual(ctx.exception.status, 404)
+
+            os.remove(path + ".idx")
+            self.assertEqual(archive.ReplaySession(path).index, replay.index)
+
+    async def test_crawl_page_replay_logs_missing_book_and_continues(self):
+        """A book page missing from the archive is a logged 404, not a crash."""
+        listing = '<article class="product_pod"><h3><a href="missing_1/index.html">B</a></h3></article>'
+        page_url = crawler.BASE_URL + "catalogue/page-1.html"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "crawl.warc.gz")
+            with open(path, "wb") as f:
+                f.write(archive.encode_record(page_url, 200, {}, listing.encode("utf-8")))
+            replay = archive.ReplaySession(path)
+
+            with patch("crawler.crawler.save_observations", AsyncMock()), \
+                    patch("crawler.crawler.save_progress", AsyncMock()) as mock_progress, \
+                    self.assertLogs("book_scraper", level="ERROR") as logs:
+                self.assertTrue(await crawler.crawl_page(replay, {}, 1))
+
+        mock_progress.assert_awaited_with({}, 1)
+        self.assertIn("404", logs.output[0])
+
+    def test_scan_index_walks_members_and_skips_truncated_tail(self):
+        records = [archive.encode_record(f"https://example.com/{i}", 200, {}, os.urandom(100_000))
+                   for i in range(3)]
+        data = b"".join(records)
+        with patch("crawler.archive.SCAN_CHUNK_SIZE", 4096):  # Members span many chunks
+            index = archive.scan_index(data)
+            self.assertEqual(index["https://example.com/2"], (len(records[0]) + len(records[1]), len(records[2])))
+            self.assertEqual(len(archive.scan_index(data[:-10])), 2)
+
+    def test_reparse_doc_reports_changed_fields(self):
+        url = "https://books.toscrape.com/test"
+        doc = get_book_metadata.parse_book_html(BOOK_HTML, url).model_dump(mode="json")
+        doc["_id"] = 1
+        doc["content_hash"] = utils.compute_hash(doc)
+        self.assertIsNone(backfill.reparse_doc(doc))
+
+        doc["price_incl_tax"] = "£11.00"
+        doc["description"] = "Old parser output"
+        doc["content_hash"] = utils.compute_hash(doc)
+        result = backfill.reparse_doc(doc)
+        self.assertEqual(result["updates"]["price_incl_tax"], "£12.00")
+        self.assertEqual(result["updates"]["description"], "Description text here.")
+        self.assertIn("content_hash", result["updates"])
+        self.assertEqual(list(result["changes"]), ["price_incl_tax"])  # Tracked fields only
+
+        errors = backfill.reparse_batch([{"_id": 2, "raw_html": "<html></html>", "source_url": url}])
+        self.assertIn("error", errors[0])
+
+    async def test_run_backfill_bulk_writes_and_checkpoints(self):
+        url = "https://books.toscrape.com/test"
+        doc = get_book_metadata.parse_book_html(BOOK_HTML, url).model_dump(mode="json")
+        docs = [{**doc, "_id": 1, "rating": 1}, {**doc, "_id": 2, "rating": 1}]
+
+        class FakeCursor:
+            def sort(self, *a): return self
+            def batch_size(self, n): return self
+            async def __aiter__(self):
+                for d in docs:
+                    yield dict(d)
+
+        fake_books = MagicMock()
+        fake_books.find.return_value = FakeCursor()
+        fake_books.bulk_write = AsyncMock()
+        fake_changelog = MagicMock()
+        fake_changelog.insert_many = AsyncMock()
+        fake_db = {db.COLLECTION: fake_books, db.CHANGELOG_COLLECTION: fake_changelog}
+
+        with patch("crawler.backfill.get_backfill_checkpoint", AsyncMock(return_value=None)), \
+                patch("crawler.backfill.save_backfill_checkpoint", AsyncMock()) as mock_checkpoint, \
+                patch("crawler.backfill.bump_catalog_version", AsyncMock()) as mock_bump:
+            stats = await backfill.run_backfill(fake_db, changelog=True, workers=1, batch_size=1)
+        mock_bump.assert_awaited_once()
+
+        self.assertEqual(stats, {"scanned": 2, "changed": 2, "errors": 0})
+        self.assertEqual(fake_books.bulk_write.await_count, 2)
+        self.assertEqual(fake_changelog.insert_many.await_count, 2)
+        self.assertEqual([c.args[1] for c in mock_checkpoint.await_args_list], [1, 2, None])
+
+    async def test_process_book_skips_unchanged_via_hash_index(self):
+        """Unchanged books are dropped before save_book, changed ones update the index."""
+        url = "https://books.toscrape.com/test"
+        fields = get_book_metadata.parse_book_fields(BOOK_HTML, url)
+        hash_index = utils.HashIndex()
+        hash_index.add(url, utils.compute_hash(fields))
+
+        with patch("crawler.crawler.fetch", AsyncMock(return_value=BOOK_HTML)), \
+                patch("crawler.crawler.save_book", AsyncMock()) as mock_save:
+            await crawler.process_book(None, {}, url, hash_index=hash_index)
+            mock_save.assert_not_awaited()
+
+            hash_index.add(url, utils.compute_hash({**fields, "price_incl_tax": "£1.00"}))
+            await crawler.process_book(None, {}, url, hash_index=hash_index)
+            mock_save.assert_awaited_once()
+        self.assertTrue(hash_index.is_unchanged(url, utils.compute_hash(fields)))
+
+    async def test_hash_index_matches_raw_url_against_stored_source_url(self):
+        """load_hash_index reads normalized source_urls; process_book looks up the raw crawl URL."""
+        url = "https://Books.toscrape.com/catalogue/caf\u00e9 noir_1/index.html"
+        fields = get_book_metadata.parse_book_fields(BOOK_HTML, url)
+        stored = {"source_url": utils.normalize_url(url), "content_hash": utils.compute_hash(fields)}
+        self.assertNotEqual(stored["source_url"], url)
+
+        class FakeCursor:
+            def __aiter__(self):
+                async def gen():
+                    yield stored
+                return gen()
+
+        fake_books = MagicMock()
+        fake_books.find.return_value = FakeCursor()
+        hash_index = await db.load_hash_index({db.COLLECTION: fake_books})
+
+        with patch("crawler.crawler.fetch", AsyncMock(return_value=BOOK_HTML)), \
+                patch("crawler.crawler.save_book", AsyncMock()) as mock_save:
+            await crawler.process_book(None, {}, url, hash_index=hash_index)
+        mock_save.assert_not_awaited()
+
+    def test_fields_hash_matches_saved_doc_hash(self):
+        """The pre-model fingerprint must match the one save_book stores."""
+        url = "https://books.toscrape.com/test"
+        fields = get_book_metadata.parse_book_fields(BOOK_HTML, url)
+        doc = get_book_metadata.parse_book_html(BOOK_HTML, url).model_dump(mode="json")
+        self.assertEqual(utils.compute_hash(fields), utils.compute_hash(doc))
+
+    async def test_crawl_page_continues_when_history_write_fails(self):
+        """A failed history write is logged, the page checkpoint is still saved."""
+        page_html = '<article class="product_pod"><h3><a href="book_1/index.html">B</a></h3></article>'
+        with patch("crawler.crawler.fetch", AsyncMock(return_value=page_html)), \
+                patch("crawler.crawler.process_book", AsyncMock(return_value={"source_url": "u"})), \
+                patch("crawler.crawler.save_observations", AsyncMock(side_effect=Exception("boom"))), \
+                patch("crawler.crawler.save_progress", AsyncMock()) as mock_progress:
+            self.assertTrue(await crawler.crawl_page(None, {}, 3))
+        mock_progress.assert_awaited_with({}, 3)
+
+    async def test_save_observations_key_matches_stored_source_url(self):
+        fake_history = MagicMock()
+        fake_history.bulk_write = AsyncMock()
+        url = "https://Books.toscrape.com/catalogue/a book_1/index.html"
+        fields = {**get_book_metadata.parse_book_fields(BOOK_HTML, url), "source_url": url}
+        stored_url = models.Book(**fields).model_dump(mode="json")["source_url"]
+
+        await db.save_observations({db.HISTORY_COLLECTION: fake_history}, [fields])
+
+        (operation,) = fake_history.bulk_write.await_args.args[0]
+        self.assertNotEqual(url, stored_url)
+        self.assertEqual(operation._filter["book_url"], stored_url)
+
+    def test_downsample_min_max_last(self):
+        self.assertEqual(utils.parse_stock("In stock (22 available)"), 22)
+        self.assertEqual(utils.parse_stock("Out of stock"), 0)
+
+        points = [
+            utils.build_observation({"price_incl_tax": "£12.00", "price_excl_tax": "£10.00",
+                                     "availability": "In stock (5 available)", "rating": 4},
+                                    datetime(2025, 11, 3, 12)),
+            utils.build_observation({"price_incl_tax": "£9.00", "price_excl_tax": "£8.00",
+                                     "availability": "In stock (3 available)", "rating": 4},
+                                    datetime(2025, 11, 4, 12)),
+            utils.build_observation({"price_incl_tax": "£11.00", "price_excl_tax": "£9.00",
+                                     "availability": "In stock (2 available)", "rating": 5},
+                                    datetime(2025, 11, 10, 12)),
+        ]
+        self.assertEqual(len(utils.downsample(points, "day")), 3)
+
+        weeks = utils.downsample(list(reversed(points)), "week")
+        self.assertEqual([w["t"] for w in weeks], [datetime(2025, 11, 3), datetime(2025, 11, 10)])
+        self.assertEqual(weeks[0]["count"], 2)
+        self.assertEqual(weeks[0]["price_incl_tax"], {"min": 9.0, "max": 12.0, "last": 9.0})
+        self.assertEqual(weeks[0]["stock"], {"min": 3, "max": 5, "last": 3})
+
+        point = api_models.HistoryPoint(**weeks[0]).model_dump(mode="json")
+        self.assertEqual(point["stock"], {"min": 3, "max": 5, "last": 3})
+        self.assertIsInstance(point["rating"]["last"], int)
+
+    async def test_save_observations_bulk_upserts_monthly_buckets(self):
+        fake_history = MagicMock()
+        fake_history.bulk_write = AsyncMock()
+        fake_db = {db.HISTORY_COLLECTION: fake_history}
+        books = [get_book_metadata.parse_book_fields(BOOK_HTML, "https://books.toscrape.com/test")]
+
+        await db.save_observations(fake_db, books)
+        await db.save_observations(fake_db, [])
+
+        fake_history.bulk_write.assert_awaited_once()
+        (operation,) = fake_history.bulk_write.await_args.args[0]
+        self.assertEqual(operation._filter["book_url"], "https://books.toscrape.com/test")
+        self.assertEqual(operation._filter["bucket_start"].day, 1)
+        self.assertEqual(operation._doc["$push"]["points"]["price_incl_tax"], 12.0)
+        self.assertTrue(operation._upsert)
+
+    def test_catalog_snapshot_query(self):
+        docs = [
+            {"name": "A", "category": "Poetry", "price_incl_tax": "£20.00", "rating": 3,
+             "number_of_reviews": "10", "availability": "In stock (2 available)", "raw_html": "<html>"},
+            {"name": "B", "category": "Fiction", "price_incl_tax": "£5.00", "rating": 5,
+             "number_of_reviews": "2", "availability": "In stock (9 available)"},
+            {"name": "C", "category": "Poetry", "price_incl_tax": "£9.50", "rating": 4,
+             "number_of_reviews": "7", "availability": "Out of stock"},
+        ]
+        catalog = snapshot.CatalogSnapshot(docs, version=1)
+        self.assertNotIn("raw_html", catalog.rows[0])
+
+        total, items = catalog.query(sort_by="price")
+        self.assertEqual(total, 3)
+        self.assertEqual([i["name"] for i in items], ["B", "C", "A"])
+
+        total, items = catalog.query(category="Poetry", max_price=10, fields=["name"])
+        self.assertEqual((total, items), (1, [{"name": "C"}]))
+
+        total, items = catalog.query(rating=4, sort_by="reviews", page=2, page_size=1)
+        self.assertEqual(total, 2)
+        self.assertEqual(items[0]["name"], "C")
+
+        self.assertEqual(catalog.query(category="Unknown"), (0, []))
+
+    async def test_snapshot_store_reloads_on_new_version(self):
+        progress = MagicMock()
+        progress.find_one = AsyncMock(return_value={"version": 1})
+        cursor = MagicMock()
+        cursor.sort.return_value = cursor
+        cursor.to_list = AsyncMock(return_value=[{"name": "A", "category": "Poetry", "rating": 3}])
+        books = MagicMock()
+        books.find.return_value = cursor
+        fake_db = {db.PROGRESS_COLLECTION: progress, db.COLLECTION: books}
+
+        store = snapshot.SnapshotStore()
+        self.assertTrue(await store.refresh(fake_db))
+        self.assertFalse(await store.refresh(fake_db))  # Same version, no reload
+        progress.find_one.return_value = {"version": 2}
+        self.assertTrue(await store.refresh(fake_db))
+        self.assertEqual(store.current.version, 2)
+        self.assertEqual(books.find.call_count, 2)
+
+    async def test_mongo_and_snapshot_paths_return_same_order(self):
+        """Switching API_SERVING_MODE (or asking for non-summary fields) keeps the order."""
+        docs = [
+            {"_id": 1, "name": "A", "category": "Poetry", "price_incl_tax": "£20.00", "rating": 3,
+             "number_of_reviews": "10", "description": "a"},
+            {"_id": 2, "name": "B", "category": "Poetry", "price_incl_tax": "£5.00", "rating": 5,
+             "number_of_reviews": "2", "description": "b"},
+            {"_id": 3, "name": "C", "category": "Poetry", "price_incl_tax": "£100.00", "rating": 3,
+             "number_of_reviews": "7", "description": "c"},
+            {"_id": 4, "name": "D", "category": "Poetry", "price_incl_tax": "£9.50", "rating": 4,
+             "number_of_reviews": "10", "description": "d"},
+        ]
+        fake_collection = MagicMock()
+        fake_collection.aggregate.side_effect = lambda pipeline: FakeAggregateCursor(docs, pipeline)
+        fake_collection.count_documents = AsyncMock(return_value=len(docs))
+        catalog = snapshot.CatalogSnapshot([{k: v for k, v in d.items() if k != "_id"} for d in docs])
+
+        async def names(fields, current):
+            with patch("api.api.DB", {db.COLLECTION: fake_collection}), \
+                    patch.object(api.catalog, "current", current):
+                pages = []
+                for page in (1, 2):
+                    response = await api.list_books(
+                        category=None, min_price=None, max_price=None, rating=None,
+                        sort_by=sort_by, page=page, page_size=2, fields=fields,
+                    )
+                    pages += [item["name"] for item in json.loads(response.body)["items"]]
+                return pages
+
+        for sort_by, expected in [("price", "BDAC"), ("reviews", "BCAD"), ("rating", "ACDB")]:
+            with self.subTest(sort_by=sort_by):
+                self.assertEqual("".join(await names(None, catalog)), expected)  # Snapshot
+                self.assertEqual("".join(await names(None, None)), expected)  # Mongo
+                self.assertEqual("".join(await names("name,description", catalog)), expected)  # Fallback
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -1,5 +1,9 @@
 import hashlib
 import logging
+import re
+from datetime import datetime, timedelta
+
+from pydantic import HttpUrl, TypeAdapter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,6 +16,8 @@ logging.basicConfig(
 
 logger = logging.getLogger("book_scraper")
 
+URL_ADAPTER = TypeAdapter(HttpUrl)
+
 
 def build_fingerprint(doc):
     """Return a string fingerprint for a book."""
@@ -31,6 +37,96 @@ def compute_hash(doc):
     return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
 
 
+class HashIndex:
+    """
+    Crawl-scoped source_url -> content_hash index.
+    Keeps the first 16 bytes of each SHA-256 instead of the 64-char hex string.
+    URLs are keyed by normalize_url, so raw crawl URLs match stored source_urls.
+    """
+
+    def __init__(self):
+        self._digests = {}
+
+    def __len__(self):
+        return len(self._digests)
+
+    def add(self, url, content_hash):
+        self._digests[normalize_url(url)] = bytes.fromhex(content_hash[:32])
+
+    def is_unchanged(self, url, content_hash):
+        return self._digests.get(normalize_url(url)) == bytes.fromhex(content_hash[:32])
+
+
+def normalize_url(url) -> str:
+    """Normalize a URL the way Book.source_url is stored (lowercase host, percent-encoding)."""
+    return str(URL_ADAPTER.validate_python(str(url)))
+
+
+def parse_price(price_str: str) -> float:
+    """Convert '£10.00' -> 10.0. Fallback to 0.0 on any error."""
+    if not price_str:
+        return 0.0
+    # Remove currency symbol and commas
+    cleaned = price_str.replace("£", "").replace(",", "").strip()
+    try:
+        return float(cleaned)
+    except ValueError:
+        return 0.0
+
+
+def parse_stock(availability: str) -> int:
+    """Convert 'In stock (22 available)' -> 22. 0 when no count is given."""
+    match = re.search(r"(\d+) available", availability or "")
+    return int(match.group(1)) if match else 0
+
+
+def build_observation(book_fields, observed_at):
+    """Numeric price/stock/rating point for the book history."""
+    return {
+        "t": observed_at,
+        "price_incl_tax": parse_price(book_fields.get("price_incl_tax")),
+        "price_excl_tax": parse_price(book_fields.get("price_excl_tax")),
+        "stock": parse_stock(book_fields.get("availability")),
+        "rating": book_fields.get("rating", 0),
+    }
+
+
+SERIES_FIELDS = ("price_incl_tax", "price_excl_tax", "stock", "rating")
+
+
+def truncate_time(t: datetime, resolution: str) -> datetime:
+    """Start of the day/week/month that `t` falls in."""
+    day = datetime(t.year, t.month, t.day)
+    if resolution == "week":
+        return day - timedelta(days=t.weekday())
+    if resolution == "month":
+        return datetime(t.year, t.month, 1)
+    return day
+
+
+def downsample(points, resolution):
+    """
+    Group history points per day/week/month.
+    Each series gets {"min", "max", "last"} for the group.
+    """
+    groups = {}
+    for point in sorted(points, key=lambda p: p["t"]):
+        start = truncate_time(point["t"], resolution)
+        group = groups.get(start)
+        if group is None:
+            group = groups[start] = {"t": start, "count": 0}
+            for field in SERIES_FIELDS:
+                group[field] = {"min": point[field], "max": point[field], "last": point[field]}
+
+        group["count"] += 1
+        for field in SERIES_FIELDS:
+            stats = group[field]
+            stats["min"] = min(stats["min"], point[field])
+            stats["max"] = max(stats["max"], point[field])
+            stats["last"] = point[field]
+    return list(groups.values())
+
+
 def build_changed_content(current_doc, existing_doc):
     """Returns the dictionary of changes"""
     changed_content = {}